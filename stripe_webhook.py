@@ -1,88 +1,289 @@
+import asyncio
+import hashlib
+import hmac
+import logging
 import os
-import stripe
+import re
+import time
+from types import MappingProxyType
+import msgspec
 import psycopg
+import stripe
+from cachetools import TTLCache
 from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
 from fastapi import FastAPI, Request, Header, HTTPException
-from fastapi.responses import JSONResponse, HTMLResponse
-from pydantic import BaseModel
+from fastapi.responses import HTMLResponse, Response
+from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
 
 # ----------------- ENV -----------------
 DATABASE_URL = os.getenv("DATABASE_URL", "").strip()
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY", "").strip()
 STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET", "").strip()
+_WEBHOOK_SECRET_BYTES = STRIPE_WEBHOOK_SECRET.encode("utf-8")  # HMAC-ключ, кодируется один раз
 
 BOT_USERNAME = os.getenv("BOT_USERNAME", "mu_sic_aibot").strip()
 PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "https://musicai-webhook.onrender.com").strip()
 
+# Размер пула на воркер. За PgBouncer (transaction pooling) реальных соединений к Postgres
+# столько, сколько даёт default_pool_size, а не workers × DB_POOL_MAX.
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "2"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "20"))
+# "none" — отключить server-side prepared statements (PgBouncer < 1.21 в transaction mode)
+_prepare_threshold = os.getenv("DB_PREPARE_THRESHOLD", "0").strip().lower()
+DB_PREPARE_THRESHOLD = None if _prepare_threshold in ("", "none") else int(_prepare_threshold)
+# Как часто (сек) фоном разбирать pending-события, оставшиеся после падения/рестарта
+CREDIT_DRAIN_INTERVAL = int(os.getenv("CREDIT_DRAIN_INTERVAL", "60"))
+
 stripe.api_key = STRIPE_SECRET_KEY
 app = FastAPI()
+log = logging.getLogger("stripe_webhook")
 
-PACK_TO_SONGS = {"pack_1": 1, "pack_5": 5, "pack_30": 30}
+PACK_TO_SONGS = MappingProxyType({"pack_1": 1, "pack_5": 5, "pack_30": 30})
+
+# Диапазон BIGINT (users.user_id, stripe_purchases.user_id)
+BIGINT_MIN = -(1 << 63)
+BIGINT_MAX = (1 << 63) - 1
 
 
 # ----------------- DB -----------------
-def db_conn():
+# Один пул на процесс: соединения переиспользуются между вебхуками,
+# без TCP+TLS хендшейка на каждый запрос. Открывается в _startup.
+# Async-пул, чтобы запросы к БД не блокировали event loop.
+POOL = AsyncConnectionPool(
+    DATABASE_URL,
+    min_size=DB_POOL_MIN,
+    max_size=DB_POOL_MAX,
+    # по умолчанию prepare_threshold=0: горячие запросы вебхука сразу идут как server-side prepared statements
+    kwargs={"row_factory": dict_row, "prepare_threshold": DB_PREPARE_THRESHOLD},
+    open=False,
+)
+
+
+def db_conn(timeout: float | None = None):
     if not DATABASE_URL:
         raise RuntimeError("DATABASE_URL is not set")
-    return psycopg.connect(DATABASE_URL, row_factory=dict_row)
+    return POOL.connection(timeout=timeout)
+
+
+async def init_db():
+    async with db_conn() as conn:
+        # DDL отправляется одним пакетом, без round-trip на каждый запрос.
+        # Advisory lock до конца транзакции: при --workers N схему создаёт один воркер,
+        # остальные ждут его COMMIT и проходят CREATE ... IF NOT EXISTS вхолостую.
+        async with conn.transaction(), conn.pipeline(), conn.cursor() as cur:
+            await cur.execute("SELECT pg_advisory_xact_lock(hashtext('musicai_schema'))")
+            await cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS users (
+                    user_id BIGINT PRIMARY KEY,
+                    lang TEXT NOT NULL DEFAULT 'en',
+                    balance INT NOT NULL DEFAULT 0,
+                    demo_used INT NOT NULL DEFAULT 0,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                );
+                """
+            )
+            await cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS stripe_purchases (
+                    session_id TEXT PRIMARY KEY,
+                    user_id BIGINT NOT NULL,
+                    pack TEXT NOT NULL,
+                    songs INT NOT NULL,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                );
+                """
+            )
+            await cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS webhook_events (
+                    external_id TEXT PRIMARY KEY,
+                    type TEXT NOT NULL,
+                    payload JSONB NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    error TEXT,
+                    received_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                );
+                """
+            )
+            await cur.execute(
+                """
+                CREATE INDEX IF NOT EXISTS webhook_events_pending
+                ON webhook_events(received_at) WHERE status = 'pending';
+                """
+            )
 
 
-def init_db():
-    with db_conn() as conn:
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS users (
-                user_id BIGINT PRIMARY KEY,
-                lang TEXT NOT NULL DEFAULT 'en',
-                balance INT NOT NULL DEFAULT 0,
-                demo_used INT NOT NULL DEFAULT 0,
-                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-            );
-            """
-        )
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS stripe_purchases (
-                session_id TEXT PRIMARY KEY,
-                user_id BIGINT NOT NULL,
-                pack TEXT NOT NULL,
-                songs INT NOT NULL,
-                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-            );
+async def record_event(external_id: str, event_type: str, payload: str) -> bool:
+    """
+    Сохраняет сырое событие Stripe в webhook_events со статусом pending (один INSERT).
+    Возвращает True если событие новое, False если такой event.id уже был.
+    """
+    async with db_conn() as conn, conn.transaction():
+        cur = await conn.execute(
             """
+            INSERT INTO webhook_events(external_id, type, payload)
+            VALUES (%s, %s, %s::jsonb)
+            ON CONFLICT (external_id) DO NOTHING
+            """,
+            (external_id, event_type, payload),
         )
-        conn.commit()
+        return cur.rowcount == 1
 
 
-def add_balance_once(session_id: str, user_id: int, pack: str, songs: int) -> bool:
+async def apply_purchase(conn, session_id: str, user_id: int, pack: str, songs: int) -> int | None:
     """
-    Начисляет баланс ровно один раз на session_id.
-    Возвращает True если начислило, False если session_id уже был обработан.
+    Фиксирует покупку и начисляет баланс одним запросом, ровно один раз на session_id.
+    Ключ дедупликации (stripe_purchases.session_id) не может быть занят без начисления:
+    пользователь создаётся/получает songs только если покупка реально вставилась.
+    Возвращает новый баланс, или None если session_id уже был обработан.
     """
-    with db_conn() as conn:
-        conn.execute("INSERT INTO users(user_id) VALUES(%s) ON CONFLICT DO NOTHING", (user_id,))
-        try:
-            conn.execute(
-                "INSERT INTO stripe_purchases(session_id, user_id, pack, songs) VALUES (%s, %s, %s, %s)",
-                (session_id, user_id, pack, songs),
-            )
-        except Exception:
-            conn.rollback()
-            return False
+    cur = await conn.execute(
+        """
+        WITH ins AS (
+            INSERT INTO stripe_purchases(session_id, user_id, pack, songs)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (session_id) DO NOTHING
+            RETURNING user_id, songs
+        )
+        INSERT INTO users(user_id, balance)
+        SELECT user_id, songs FROM ins
+        ON CONFLICT (user_id) DO UPDATE SET balance = users.balance + EXCLUDED.balance
+        RETURNING balance
+        """,
+        (session_id, user_id, pack, songs),
+    )
+    row = await cur.fetchone()
+    return row["balance"] if row else None
+
+
+async def credit_pending() -> None:
+    """
+    Разбирает pending-события из webhook_events (запускается в фоне после ответа Stripe).
+    Каждое событие — отдельная транзакция: покупка, начисление и смена статуса
+    коммитятся вместе. FOR UPDATE SKIP LOCKED позволяет нескольким задачам/воркерам
+    разбирать очередь параллельно, не беря одно событие дважды.
+    Событие с ошибкой, которая повторится при любой попытке (битый payload, данные
+    не влезают в схему), помечается failed с текстом ошибки, чтобы не блокировать очередь.
+    Временные ошибки (обрыв соединения, таймаут, deadlock, serialization failure)
+    пробрасываются: транзакция откатывается, событие остаётся pending до следующего разбора.
+    """
+    async with db_conn() as conn:
+        while True:
+            async with conn.transaction():
+                cur = await conn.execute(
+                    """
+                    SELECT external_id, payload FROM webhook_events
+                    WHERE status = 'pending'
+                    ORDER BY received_at
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                    """
+                )
+                row = await cur.fetchone()
+                if row is None:
+                    return
+
+                error = None
+                try:
+                    # savepoint: ошибка откатывает только начисление, блокировка строки остаётся
+                    async with conn.transaction():
+                        purchase = _purchase_from_event(msgspec.convert(row["payload"], StripeEvent))
+                        if purchase is not None:
+                            balance = await apply_purchase(conn, *purchase)
+                            if balance is None:
+                                status = "duplicate"  # session_id уже начислен другим событием
+                            else:
+                                status = "done"
+                                log.info("credited user %s: +%s songs, balance %s", purchase[1], purchase[3], balance)
+                        else:
+                            status = "ignored"
+                except (msgspec.ValidationError, ValueError, psycopg.errors.DataError) as e:
+                    log.exception("webhook event %s failed", row["external_id"])
+                    status, error = "failed", f"{type(e).__name__}: {e}"
+
+                await conn.execute(
+                    "UPDATE webhook_events SET status = %s, error = %s WHERE external_id = %s",
+                    (status, error, row["external_id"]),
+                )
+
+
+async def _drain_pending():
+    try:
+        await credit_pending()
+    except Exception:
+        log.exception("credit_pending failed")
+
 
-        conn.execute("UPDATE users SET balance = balance + %s WHERE user_id=%s", (songs, user_id))
-        conn.commit()
-        return True
+# Один разборщик на процесс (держит одно соединение из пула). Вебхук только будит его,
+# иначе при всплеске разборщики заняли бы весь пул и record_event ждал бы соединения.
+_drain_wakeup = asyncio.Event()
+
+
+async def _drain_forever():
+    while True:
+        try:
+            await asyncio.wait_for(_drain_wakeup.wait(), CREDIT_DRAIN_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        # сбрасываем до разбора: события, пришедшие во время разбора, разбудят следующий круг
+        _drain_wakeup.clear()
+        await _drain_pending()
 
 
 @app.on_event("startup")
-def _startup():
-    init_db()
+async def _startup():
+    if not DATABASE_URL:
+        raise RuntimeError("DATABASE_URL is not set")
+    await POOL.open(wait=True)
+    await init_db()
+    # События, записанные, но не начисленные до рестарта: Stripe их уже не повторит
+    await _drain_pending()
+    app.state.drain_task = asyncio.create_task(_drain_forever())
+
+
+@app.on_event("shutdown")
+async def _shutdown():
+    # drain_task нет, если _startup упал раньше — не маскируем исходную ошибку
+    drain_task = getattr(app.state, "drain_task", None)
+    if drain_task is not None:
+        drain_task.cancel()
+        try:
+            await drain_task
+        except asyncio.CancelledError:
+            pass
+    await POOL.close()
+
+
+# ----------------- HEALTH -----------------
+# /healthz — liveness для частых проб балансировщика, БД не трогает.
+# /readyz — редкая проверка готовности: SELECT 1 через соединение из пула.
+@app.get("/healthz")
+async def healthz():
+    return {"ok": True}
+
+
+# Проба должна быстро отдать 503, а не ждать 30 с дефолтного таймаута пула
+READYZ_TIMEOUT = 2.0
+
+
+@app.get("/readyz")
+async def readyz():
+    try:
+        async with db_conn(timeout=READYZ_TIMEOUT) as conn:
+            await conn.execute("SELECT 1")
+    except Exception:
+        # текст ошибки БД — в лог, не в ответ неаутентифицированному клиенту
+        log.exception("readyz: DB check failed")
+        raise HTTPException(status_code=503, detail="DB not ready")
+    return {"ok": True}
 
 
 # ----------------- CREATE CHECKOUT -----------------
 class CreateCheckoutBody(BaseModel):
-    user_id: int           # telegram user id
+    user_id: int = Field(ge=BIGINT_MIN, le=BIGINT_MAX)  # telegram user id
     pack: str              # pack_1 / pack_5 / pack_30
     price_id: str          # Stripe Price ID: price_...
 
@@ -102,8 +303,10 @@ async def create_checkout(body: CreateCheckoutBody):
     success_url = f"{PUBLIC_BASE_URL}/stripe/success?session_id={{CHECKOUT_SESSION_ID}}"
     cancel_url = f"{PUBLIC_BASE_URL}/stripe/cancel"
 
+    # stripe SDK синхронный (HTTP-запрос к Stripe) — выносим в тредпул, чтобы не блокировать event loop
     try:
-        session = stripe.checkout.Session.create(
+        session = await run_in_threadpool(
+            stripe.checkout.Session.create,
             mode="payment",
             line_items=[{"price": body.price_id, "quantity": 1}],
             success_url=success_url,
@@ -121,12 +324,12 @@ async def create_checkout(body: CreateCheckoutBody):
 
 
 # ----------------- SUCCESS/CANCEL PAGES -----------------
-@app.get("/stripe/success", response_class=HTMLResponse)
-def stripe_success(session_id: str):
-    tme = f"https://t.me/{BOT_USERNAME}?start=paid_{session_id}"
-    tg = f"tg://resolve?domain={BOT_USERNAME}&start=paid_{session_id}"
-
-    return HTMLResponse(f"""
+# Страницы собираются один раз при импорте; на запрос подставляем только session_id.
+_SID = "__SID__"
+_SID_BYTES = _SID.encode()
+_SUCCESS_TME = f"https://t.me/{BOT_USERNAME}?start=paid_{_SID}"
+_SUCCESS_TG = f"tg://resolve?domain={BOT_USERNAME}&start=paid_{_SID}"
+_SUCCESS_TMPL: bytes = f"""
 <!doctype html><html><head>
 <meta charset="utf-8">
 <meta name="viewport" content="width=device-width,initial-scale=1">
@@ -134,65 +337,202 @@ def stripe_success(session_id: str):
 <body style="font-family:system-ui;padding:24px;">
 <h3>Оплата прошла ✅</h3>
 <p>Если Telegram не открылся автоматически — нажми кнопку ниже.</p>
-<p><a href="{tme}" style="font-size:18px;">↩️ Вернуться в бота</a></p>
+<p><a href="{_SUCCESS_TME}" style="font-size:18px;">↩️ Вернуться в бота</a></p>
 <script>
-  setTimeout(() => {{ window.location.href = "{tg}"; }}, 50);
-  setTimeout(() => {{ window.location.href = "{tme}"; }}, 900);
+  setTimeout(() => {{ window.location.href = "{_SUCCESS_TG}"; }}, 50);
+  setTimeout(() => {{ window.location.href = "{_SUCCESS_TME}"; }}, 900);
 </script>
 </body></html>
-""")
+""".encode()
 
-
-@app.get("/stripe/cancel", response_class=HTMLResponse)
-def stripe_cancel():
-    tme = f"https://t.me/{BOT_USERNAME}?start=cancel"
-    return HTMLResponse(f"""
+_CANCEL_TME = f"https://t.me/{BOT_USERNAME}?start=cancel"
+_CANCEL_BYTES: bytes = f"""
 <!doctype html><html><head>
 <meta charset="utf-8">
 <meta name="viewport" content="width=device-width,initial-scale=1">
 <title>Cancel</title></head>
 <body style="font-family:system-ui;padding:24px;">
 <h3>Оплата отменена</h3>
-<p><a href="{tme}" style="font-size:18px;">↩️ Вернуться в бота</a></p>
+<p><a href="{_CANCEL_TME}" style="font-size:18px;">↩️ Вернуться в бота</a></p>
 </body></html>
-""")
+""".encode()
+
+# Stripe Checkout Session ID: cs_test_... / cs_live_...
+_SESSION_ID_RE = re.compile(r"cs_[A-Za-z0-9_]+")
+_HTML_MEDIA_TYPE = "text/html; charset=utf-8"
+
+
+@app.get("/stripe/success", response_class=HTMLResponse)
+def stripe_success(session_id: str):
+    # session_id попадает в HTML/JS — пропускаем только формат Stripe
+    if not _SESSION_ID_RE.fullmatch(session_id):
+        raise HTTPException(status_code=400, detail="Invalid session_id")
+
+    body = _SUCCESS_TMPL.replace(_SID_BYTES, session_id.encode())
+    return Response(content=body, media_type=_HTML_MEDIA_TYPE)
+
+
+@app.get("/stripe/cancel", response_class=HTMLResponse)
+def stripe_cancel():
+    return Response(content=_CANCEL_BYTES, media_type=_HTML_MEDIA_TYPE)
 
 
 # ----------------- WEBHOOK -----------------
+# event.id уже обработанных событий (в пределах процесса): повторные доставки Stripe
+# отвечаем без похода в БД. Настоящая идемпотентность — PK webhook_events и stripe_purchases.
+_seen_events = TTLCache(maxsize=10_000, ttl=3600)
+
+# Stripe шлёт события в десятки KB; всё, что больше, отбрасываем ещё до проверки подписи
+MAX_WEBHOOK_BODY = 1 << 20  # 1 MiB
+
+
+async def _read_capped(request: Request, limit: int = MAX_WEBHOOK_BODY) -> bytearray:
+    buf = bytearray()
+    async for chunk in request.stream():
+        buf += chunk
+        if len(buf) > limit:
+            raise HTTPException(status_code=413, detail="Payload too large")
+    return buf
+
+
+# Из события декодируем только нужные поля — остальной JSON msgspec пропускает
+class EventMetadata(msgspec.Struct):
+    user_id: str | None = None
+    pack: str | None = None
+
+
+class EventObject(msgspec.Struct):
+    id: str | None = None
+    payment_status: str | None = None
+    metadata: EventMetadata | None = None
+
+
+class EventData(msgspec.Struct):
+    object: EventObject
+
+
+class StripeEvent(msgspec.Struct):
+    id: str
+    type: str
+    data: EventData
+
+
+_decode_event = msgspec.json.Decoder(StripeEvent).decode
+
+# Ровно то, что пишет create_checkout через str(int): int() принял бы и "1_000", " 42 ", "+42", "٤٢"
+_USER_ID_RE = re.compile(r"-?[0-9]+")
+
+
+def _purchase_from_event(event: StripeEvent):
+    """
+    (session_id, user_id, pack, songs) для оплаченного checkout.session.completed
+    с корректными metadata, иначе None. ValueError если metadata.user_id не число
+    или не влезает в BIGINT.
+    """
+    if event.type != "checkout.session.completed":
+        return None
+
+    session = event.data.object
+    if session.payment_status != "paid":
+        return None
+
+    meta = session.metadata or EventMetadata()
+    songs = PACK_TO_SONGS.get(meta.pack)
+    if not (session.id and meta.user_id and songs):
+        return None
+
+    if not _USER_ID_RE.fullmatch(meta.user_id):
+        raise ValueError("user_id is not a decimal integer")
+    user_id = int(meta.user_id)
+    if not BIGINT_MIN <= user_id <= BIGINT_MAX:
+        raise ValueError("user_id out of BIGINT range")
+
+    return session.id, user_id, meta.pack, songs
+
+
+# Допустимое расхождение t= из Stripe-Signature с текущим временем (как в stripe SDK)
+SIGNATURE_TOLERANCE = 300
+
+
+def _verify_signature(payload: bytearray, header: str, secret: bytes) -> None:
+    """
+    Проверяет Stripe-Signature (t=...,v1=...) без stripe.Webhook.construct_event:
+    HMAC-SHA256 от "{t}.{payload}" сравнивается в constant-time с каждой v1.
+    """
+    timestamp = None
+    signatures = []
+    for item in header.split(","):
+        key, _, value = item.strip().partition("=")
+        if key == "t":
+            timestamp = value
+        elif key == "v1":
+            signatures.append(value)
+
+    try:
+        ts = int(timestamp)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid signature: no timestamp")
+    if not signatures:
+        raise HTTPException(status_code=400, detail="Invalid signature: no v1 signature")
+    if abs(time.time() - ts) > SIGNATURE_TOLERANCE:
+        raise HTTPException(status_code=400, detail="Invalid signature: timestamp outside tolerance")
+
+    mac = hmac.new(secret, f"{timestamp}.".encode(), hashlib.sha256)
+    mac.update(payload)
+    # сравниваем bytes: compare_digest падает с TypeError на не-ASCII str из поддельного заголовка
+    expected = mac.hexdigest().encode()
+    if not any(hmac.compare_digest(expected, sig.encode("utf-8", "replace")) for sig in signatures):
+        raise HTTPException(status_code=400, detail="Invalid signature: no match")
+
+
 @app.post("/stripe/webhook")
 async def stripe_webhook(request: Request, stripe_signature: str = Header(None)):
     if not STRIPE_WEBHOOK_SECRET:
         raise HTTPException(status_code=500, detail="STRIPE_WEBHOOK_SECRET not set")
 
-    payload = await request.body()
     if not stripe_signature:
         raise HTTPException(status_code=400, detail="Missing Stripe-Signature header")
 
+    payload = await _read_capped(request)
+
+    _verify_signature(payload, stripe_signature, _WEBHOOK_SECRET_BYTES)
+
     try:
-        event = stripe.Webhook.construct_event(payload, stripe_signature, STRIPE_WEBHOOK_SECRET)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Invalid signature: {e}")
-
-    if event["type"] == "checkout.session.completed":
-        session = event["data"]["object"]
-
-        # начисляем только если реально paid
-        if session.get("payment_status") != "paid":
-            return JSONResponse({"ok": True, "ignored": "not_paid"})
-
-        session_id = session.get("id")
-        meta = session.get("metadata") or {}
-        user_id = meta.get("user_id")
-        pack = meta.get("pack")
-
-        if session_id and user_id and pack in PACK_TO_SONGS:
-            songs = PACK_TO_SONGS[pack]
-            credited = add_balance_once(
-                session_id=session_id,
-                user_id=int(user_id),
-                pack=pack,
-                songs=songs,
-            )
-            return {"ok": True, "credited": credited}
+        event = _decode_event(payload)
+    except msgspec.DecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid payload: {e}")
+
+    event_id = event.id
+    if event_id in _seen_events:
+        return {"ok": True, "duplicate": True}
+
+    # начисляем только оплаченный checkout.session.completed с корректными metadata
+    try:
+        purchase = _purchase_from_event(event)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid metadata.user_id")
+
+    if purchase is not None:
+        # Синхронно — только один INSERT сырого события; начисление после ответа Stripe.
+        # Будим разборщик и для повтора (queued=False): событие могло остаться pending.
+        queued = await record_event(event_id, event.type, payload.decode())
+        _drain_wakeup.set()
+        _seen_events[event_id] = True
+        return {"ok": True, "queued": queued}
 
     return {"ok": True}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # uvloop + httptools вместо дефолтных asyncio/h11; число воркеров — WEB_CONCURRENCY (как у Render)
+    uvicorn.run(
+        "stripe_webhook:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "10000")),
+        workers=int(os.getenv("WEB_CONCURRENCY", "2")),
+        loop="uvloop",
+        http="httptools",
+        log_level="warning",
+    )
@@ -0,0 +1,291 @@
+import asyncio
+import contextlib
+import hashlib
+import hmac
+import json
+import time
+
+import msgspec
+import psycopg
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import stripe_webhook
+
+SECRET = b"whsec_test"
+PAYLOAD = bytearray(b'{"id":"evt_1","type":"charge.refunded","data":{"object":{"id":"ch_1"}}}')
+
+
+def sign(payload, t=None, secret=SECRET):
+    t = int(time.time()) if t is None else t
+    sig = hmac.new(secret, f"{t}.".encode() + bytes(payload), hashlib.sha256).hexdigest()
+    return f"t={t},v1={sig}"
+
+
+def assert_rejected(header, payload=PAYLOAD):
+    with pytest.raises(HTTPException) as exc:
+        stripe_webhook._verify_signature(payload, header, SECRET)
+    assert exc.value.status_code == 400
+
+
+def test_valid_signature():
+    stripe_webhook._verify_signature(PAYLOAD, sign(PAYLOAD), SECRET)
+
+
+def test_valid_signature_among_several_v1():
+    t = int(time.time())
+    header = sign(PAYLOAD, t)
+    stripe_webhook._verify_signature(PAYLOAD, f"t={t},v1=deadbeef,{header.split(',')[1]},v0=x", SECRET)
+
+
+def test_forged_signature():
+    assert_rejected(sign(PAYLOAD, secret=b"whsec_other"))
+
+
+def test_tampered_payload():
+    assert_rejected(sign(PAYLOAD), payload=PAYLOAD + b" ")
+
+
+def test_stale_timestamp():
+    assert_rejected(sign(PAYLOAD, t=int(time.time()) - stripe_webhook.SIGNATURE_TOLERANCE - 10))
+
+
+@pytest.mark.parametrize(
+    "header",
+    ["", "garbage", "v1=abc", "t=abc,v1=abc", f"t={int(time.time())}", f"t={int(time.time())},v1=\xe9"],
+)
+def test_malformed_header(header):
+    assert_rejected(header)
+
+
+def test_webhook_non_ascii_signature_is_400(monkeypatch):
+    monkeypatch.setattr(stripe_webhook, "STRIPE_WEBHOOK_SECRET", SECRET.decode())
+    monkeypatch.setattr(stripe_webhook, "_WEBHOOK_SECRET_BYTES", SECRET)
+    client = TestClient(stripe_webhook.app)
+
+    resp = client.post(
+        "/stripe/webhook",
+        content=bytes(PAYLOAD),
+        headers={"Stripe-Signature": f"t={int(time.time())},v1=\xe9".encode("latin-1")},
+    )
+    assert resp.status_code == 400
+
+
+def test_success_page_embeds_session_id():
+    resp = TestClient(stripe_webhook.app).get("/stripe/success", params={"session_id": "cs_test_abc"})
+    assert resp.status_code == 200
+    assert "start=paid_cs_test_abc" in resp.text
+    assert stripe_webhook._SID not in resp.text
+
+
+@pytest.mark.parametrize("session_id", ["cs_abc\n", "cs_abc\"</script>", "abc", "cs_"])
+def test_success_page_rejects_bad_session_id(session_id):
+    resp = TestClient(stripe_webhook.app).get("/stripe/success", params={"session_id": session_id})
+    assert resp.status_code == 400
+
+
+def test_healthz():
+    assert TestClient(stripe_webhook.app).get("/healthz").json() == {"ok": True}
+
+
+def test_readyz_hides_db_error(monkeypatch):
+    monkeypatch.setattr(stripe_webhook, "DATABASE_URL", "postgresql://localhost/none")
+    resp = TestClient(stripe_webhook.app).get("/readyz")  # пул не открыт
+    assert resp.status_code == 503
+    assert resp.json() == {"detail": "DB not ready"}
+
+
+def checkout_event(user_id="42", pack="pack_5", payment_status="paid", event_type="checkout.session.completed"):
+    return {
+        "id": "evt_1",
+        "type": event_type,
+        "data": {
+            "object": {
+                "id": "cs_test_1",
+                "payment_status": payment_status,
+                "metadata": {"user_id": user_id, "pack": pack},
+            }
+        },
+    }
+
+
+def purchase_from(event):
+    return stripe_webhook._purchase_from_event(msgspec.convert(event, stripe_webhook.StripeEvent))
+
+
+@pytest.mark.parametrize("user_id", ["1_000", " 42 ", "+42", "٤٢", "42.0", "0x2a"])
+def test_purchase_rejects_non_decimal_user_id(user_id):
+    with pytest.raises(ValueError):
+        purchase_from(checkout_event(user_id=user_id))
+
+
+def test_purchase_from_paid_checkout():
+    assert purchase_from(checkout_event()) == ("cs_test_1", 42, "pack_5", 5)
+
+
+@pytest.mark.parametrize(
+    "event",
+    [
+        checkout_event(event_type="checkout.session.expired"),
+        checkout_event(payment_status="unpaid"),
+        checkout_event(pack="pack_999"),
+        checkout_event(user_id=None),
+        {
+            "id": "evt_1",
+            "type": "checkout.session.completed",
+            "data": {"object": {"id": "cs_test_1", "payment_status": "paid"}},
+        },
+    ],
+)
+def test_purchase_ignores_non_creditable_events(event):
+    assert purchase_from(event) is None
+
+
+@pytest.mark.parametrize(
+    "user_id", ["abc", str(stripe_webhook.BIGINT_MAX + 1), str(stripe_webhook.BIGINT_MIN - 1)]
+)
+def test_purchase_rejects_bad_user_id(user_id):
+    with pytest.raises(ValueError):
+        purchase_from(checkout_event(user_id=user_id))
+
+
+@pytest.fixture
+def webhook(monkeypatch):
+    """TestClient + подписанная отправка события; record_event подменён, БД не нужна."""
+    monkeypatch.setattr(stripe_webhook, "STRIPE_WEBHOOK_SECRET", SECRET.decode())
+    monkeypatch.setattr(stripe_webhook, "_WEBHOOK_SECRET_BYTES", SECRET)
+    monkeypatch.setattr(stripe_webhook, "_seen_events", {})
+    monkeypatch.setattr(stripe_webhook, "_drain_wakeup", asyncio.Event())
+
+    recorded = []
+
+    async def record_event(external_id, event_type, payload):
+        recorded.append((external_id, event_type, json.loads(payload)))
+        return len(recorded) == 1
+
+    monkeypatch.setattr(stripe_webhook, "record_event", record_event)
+    client = TestClient(stripe_webhook.app)
+
+    def send(event):
+        payload = json.dumps(event).encode()
+        return client.post("/stripe/webhook", content=payload, headers={"Stripe-Signature": sign(payload)})
+
+    send.recorded = recorded
+    send.client = client
+    return send
+
+
+def test_webhook_queues_paid_checkout(webhook):
+    resp = webhook(checkout_event())
+    assert resp.json() == {"ok": True, "queued": True}
+    assert webhook.recorded == [("evt_1", "checkout.session.completed", checkout_event())]
+    assert stripe_webhook._drain_wakeup.is_set()
+
+
+@pytest.mark.parametrize("event", [checkout_event(payment_status="unpaid"), checkout_event(pack="pack_999")])
+def test_webhook_does_not_queue_non_creditable(webhook, event):
+    assert webhook(event).json() == {"ok": True}
+    assert webhook.recorded == []
+    assert not stripe_webhook._drain_wakeup.is_set()
+
+
+def test_webhook_rejects_bad_user_id(webhook):
+    assert webhook(checkout_event(user_id=str(stripe_webhook.BIGINT_MAX + 1))).status_code == 400
+    assert webhook.recorded == []
+
+
+class FakeCursor:
+    def __init__(self, row=None):
+        self.row = row
+
+    async def fetchone(self):
+        return self.row
+
+
+class FakeConn:
+    """Минимальный AsyncConnection для credit_pending: очередь событий и исход apply_purchase."""
+
+    def __init__(self, events, outcome):
+        self.events = list(events)
+        self.outcome = outcome
+        self.updates = []
+
+    async def execute(self, query, params=None):
+        if "FROM webhook_events" in query:
+            return FakeCursor(self.events.pop(0) if self.events else None)
+        if "INSERT INTO stripe_purchases" in query:
+            if isinstance(self.outcome, Exception):
+                raise self.outcome
+            return FakeCursor(self.outcome)
+        if "UPDATE webhook_events" in query:
+            self.updates.append(params)
+        return FakeCursor()
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        yield
+
+
+def fake_db(monkeypatch, outcome, event=None):
+    conn = FakeConn([{"external_id": "evt_1", "payload": event or checkout_event()}], outcome)
+
+    @contextlib.asynccontextmanager
+    async def db_conn(timeout=None):
+        yield conn
+
+    monkeypatch.setattr(stripe_webhook, "db_conn", db_conn)
+    return conn
+
+
+def run_credit_pending(monkeypatch, outcome, event=None):
+    conn = fake_db(monkeypatch, outcome, event)
+    asyncio.run(stripe_webhook.credit_pending())
+    return conn.updates
+
+
+def test_credit_pending_marks_done(monkeypatch):
+    assert run_credit_pending(monkeypatch, {"balance": 5}) == [("done", None, "evt_1")]
+
+
+def test_credit_pending_marks_duplicate_session(monkeypatch):
+    assert run_credit_pending(monkeypatch, None) == [("duplicate", None, "evt_1")]
+
+
+def test_credit_pending_marks_non_creditable_ignored(monkeypatch):
+    assert run_credit_pending(monkeypatch, None, checkout_event(pack="pack_999")) == [("ignored", None, "evt_1")]
+
+
+def test_credit_pending_fails_permanent_errors(monkeypatch):
+    outcome = psycopg.errors.NumericValueOutOfRange("out of range")
+    [(status, error, external_id)] = run_credit_pending(monkeypatch, outcome)
+    assert (status, external_id) == ("failed", "evt_1")
+    assert "NumericValueOutOfRange" in error
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        psycopg.errors.DeadlockDetected("deadlock"),
+        psycopg.errors.QueryCanceled("statement timeout"),
+        psycopg.OperationalError("connection lost"),
+    ],
+)
+def test_credit_pending_leaves_transient_errors_pending(monkeypatch, error):
+    conn = fake_db(monkeypatch, error)
+    with pytest.raises(type(error)):
+        asyncio.run(stripe_webhook.credit_pending())
+    assert conn.updates == []  # статус не тронут: транзакция откатится, событие останется pending
+
+
+def test_webhook_rejects_oversized_body(webhook):
+    payload = b"x" * (stripe_webhook.MAX_WEBHOOK_BODY + 1)
+    resp = webhook.client.post("/stripe/webhook", content=payload, headers={"Stripe-Signature": sign(payload)})
+    assert resp.status_code == 413
+    assert webhook.recorded == []
+
+
+def test_webhook_repeated_delivery_is_duplicate(webhook):
+    assert webhook(checkout_event()).json() == {"ok": True, "queued": True}
+    assert webhook(checkout_event()).json() == {"ok": True, "duplicate": True}
+    assert len(webhook.recorded) == 1  # повтор отвечен из _seen_events, без похода в БД